@@ -1,8 +1,27 @@
 from .resources import PostgresResource
+from .db_tools import (
+    has_raw_compression_column,
+    add_raw_compression_column,
+    convert_raw_storage,
+    PARTITIONED_TABLES,
+    partition_table_by_year,
+    add_year_partitions,
+)
+from datetime import datetime
 
 import dagster as dg
 import pandas as pd
 
+# etapa_*_raw tables holding ETAPA endpoints responses
+RAW_TABLES = ["etapa_swmfbq_raw", "etapa_swmfqagl_raw"]
+
+# Raw assets config, replay stored responses of a request timestamp (YYYY-MM-01 00:00:00)
+class RawReplayConfig(dg.Config):
+    replay_timestamp: str = ""
+
+# Gold assets config, rebuild rollups of every station instead of changed ones only
+class RollupConfig(dg.Config):
+    full_rebuild: bool = False
 
 
 @dg.asset()
@@ -31,4 +50,117 @@ def pg_waterq_stations(context: dg.AssetExecutionContext,
         # Dipose engine
         if engine:
             engine.dispose()
-            
+
+@dg.asset(
+    group_name="ierse_maintenance",
+)
+def pg_raw_storage_migration(context: dg.AssetExecutionContext,
+                    postgres_rsc: PostgresResource,) -> None:
+    """
+    Rewrites stored etapa_*_raw responses to the storage format set by raw_compression:
+    adds response_zlib column and compresses text rows when enabled,
+    decodes compressed rows back to text when disabled.
+    Run manually, it is not scheduled. Fails if any table could not be converted.
+    """
+    
+    engine = None
+    failed = []
+    metadata = {}
+    try:
+        # Get SQLAlchemy engine
+        engine = postgres_rsc.get_engine()
+        
+        for table_name in RAW_TABLES:
+            try:
+                if postgres_rsc.raw_compression:
+                    add_raw_compression_column(engine, table_name)
+                elif not has_raw_compression_column(engine, table_name):
+                    continue
+                n_rows = convert_raw_storage(engine, table_name, compress=postgres_rsc.raw_compression)
+                context.log.info(f"Rewrote {n_rows} {table_name} responses")
+                metadata[table_name] = n_rows
+            except Exception as exc_r:
+                context.log.error(f"Error converting {table_name} responses.\n{str(exc_r)}")
+                failed.append(table_name)
+        context.add_output_metadata(metadata)
+    finally:
+        # Dipose engine
+        if engine:
+            engine.dispose()
+    
+    # Fail the run, converted batches are kept
+    if failed:
+        raise RuntimeError(f"Could not convert raw tables: {', '.join(failed)}")
+
+@dg.asset(
+    group_name="ierse_maintenance",
+)
+def pg_partition_migration(context: dg.AssetExecutionContext,
+                    postgres_rsc: PostgresResource,) -> None:
+    """
+    One-time migration, converts ETAPA data and registro_* tables to range partitioned tables by year.
+    Tables already partitioned are skipped. Fails if any table could not be converted.
+    Run manually, it is not scheduled.
+    """
+    
+    engine = None
+    failed = []
+    try:
+        # Get SQLAlchemy engine
+        engine = postgres_rsc.get_engine()
+        
+        # Convert each table on its own transaction
+        for table_name, (key_column, unique_columns) in PARTITIONED_TABLES.items():
+            try:
+                if partition_table_by_year(engine, table_name, key_column, unique_columns):
+                    context.log.info(f"Converted {table_name} to a partitioned table, original kept as {table_name}_unpartitioned")
+                else:
+                    context.log.info(f"{table_name} is already partitioned")
+            except Exception as exc_p:
+                context.log.error(f"Error partitioning {table_name}.\n{str(exc_p)}")
+                failed.append(table_name)
+    finally:
+        # Dipose engine
+        if engine:
+            engine.dispose()
+    
+    # Fail the run, converted tables are kept
+    if failed:
+        raise RuntimeError(f"Could not partition tables: {', '.join(failed)}")
+
+@dg.asset(
+    group_name="ierse_maintenance",
+)
+def pg_year_partitions(context: dg.AssetExecutionContext,
+                    postgres_rsc: PostgresResource,) -> None:
+    """
+    Adds current and next year partitions to partitioned ETAPA data and registro_* tables,
+    ahead of pipeline runs. Tables not yet partitioned are skipped.
+    """
+    
+    engine = None
+    failed = []
+    try:
+        # Get SQLAlchemy engine
+        engine = postgres_rsc.get_engine()
+        
+        # Create upcoming years partitions
+        current_year = datetime.now().year
+        metadata = {}
+        for table_name, (key_column, _) in PARTITIONED_TABLES.items():
+            try:
+                created = add_year_partitions(engine, table_name, key_column, [current_year, current_year + 1])
+                context.log.info(f"Created {table_name} partitions for years {created}")
+                metadata[table_name] = str(created)
+            except Exception as exc_p:
+                context.log.error(f"Error creating {table_name} partitions.\n{str(exc_p)}")
+                failed.append(table_name)
+        context.add_output_metadata(metadata)
+    finally:
+        # Dipose engine
+        if engine:
+            engine.dispose()
+    
+    # Fail the run
+    if failed:
+        raise RuntimeError(f"Could not create partitions for tables: {', '.join(failed)}")
@@ -3,15 +3,29 @@ from .constants import (
     DATEF_MFQB,
 )
 from .resources import PostgresResource
-from  .tools import coerse_float
+from  .tools import (
+    coerse_float,
+    compress_response,
+    decode_response,
+)
+from .db_tools import (
+    read_raw_responses,
+    raw_stored_bytes,
+    refresh_station_rollups,
+    add_year_partitions,
+    year_partition,
+)
 from datetime import date, datetime
 from sqlalchemy import (
     MetaData,
     Table,
+    or_,
 )
 from sqlalchemy.dialects.postgresql import insert
 from .assets import (
     pg_waterq_stations,
+    RawReplayConfig,
+    RollupConfig,
 )
 
 import dagster as dg
@@ -25,11 +39,14 @@ import json
 )
 def mfqb_data_raw (context: dg.AssetExecutionContext,
                 pg_waterq_stations: pd.DataFrame,
-                postgres_rsc: PostgresResource,) -> pd.DataFrame:
+                postgres_rsc: PostgresResource,
+                config: RawReplayConfig,) -> pd.DataFrame:
     
     """
     Requests data from ETAPA swmfbq endpoint, returns a DataFrame with results for all stations.
     Upload request results to etapa_swmfbq_raw table using UPSERT operations.
+    When raw compression is enabled responses are stored zlib-compressed on response_zlib column.
+    With replay_timestamp config, stored responses of that timestamp are returned instead.
     """
     
     engine = None
@@ -37,6 +54,13 @@ def mfqb_data_raw (context: dg.AssetExecutionContext,
     df_raw = pd.DataFrame(columns=['timestamp', 'codigo',  'response'])
     
     try:
+        # Replay stored responses, decoded, instead of requesting the endpoint
+        if config.replay_timestamp:
+            engine = postgres_rsc.get_engine()
+            df_raw = read_raw_responses(engine, "etapa_swmfbq_raw", config.replay_timestamp)
+            context.log.info(f"Replaying {len(df_raw)} etapa_swmfbq_raw responses from {config.replay_timestamp}")
+            return df_raw
+        
         # Current timestamp for requests pkey
         now = datetime.now()
         timestamp_string = now.strftime("%Y-%m-01 00:00:00")
@@ -73,6 +97,9 @@ def mfqb_data_raw (context: dg.AssetExecutionContext,
             # Get SQLAlchemy engine
             engine = postgres_rsc.get_engine()
             
+            # Asset metadata
+            raw_metadata = {}
+            
             # Reflect etapa_swmfbq_raw table
             metadata = MetaData()
             etapa_swmfbq_raw = Table(
@@ -81,6 +108,23 @@ def mfqb_data_raw (context: dg.AssetExecutionContext,
                 schema="public",
                 autoload_with=engine
             )
+            
+            # Compress responses, report payload compression ratio
+            if postgres_rsc.raw_compression and "response_zlib" not in etapa_swmfbq_raw.c:
+                context.log.error("etapa_swmfbq_raw has no response_zlib column, run ierse_raw_storage_job first. Storing responses as text")
+            elif postgres_rsc.raw_compression:
+                text_bytes = df_raw['response'].str.encode("utf-8").str.len().sum()
+                df_raw['response_zlib'] = df_raw['response'].map(compress_response)
+                df_raw['response'] = None
+                zlib_bytes = df_raw['response_zlib'].str.len().sum()
+                raw_metadata["payload_utf8_bytes"] = int(text_bytes)
+                raw_metadata["payload_zlib_bytes"] = int(zlib_bytes)
+                raw_metadata["payload_compression_ratio"] = round(float(text_bytes / zlib_bytes), 2)
+            
+            # Columns updated on conflict, clear stale compressed responses
+            upsert_columns = [col for col in ["response", "response_zlib"] if col in etapa_swmfbq_raw.c]
+            if "response_zlib" in upsert_columns and "response_zlib" not in df_raw:
+                df_raw['response_zlib'] = None
 
             # Convert DataFrame to list of dicts
             records = df_raw.to_dict(orient="records")
@@ -90,13 +134,17 @@ def mfqb_data_raw (context: dg.AssetExecutionContext,
             stmt = stmt.on_conflict_do_update(
                 index_elements=["timestamp", "codigo"],
                 set_= {
-                    "response": stmt.excluded.response,
+                    col: stmt.excluded[col] for col in upsert_columns
                 }
             )
 
             # Execute statement
             with engine.begin() as conn:
                 conn.execute(stmt)
+            
+            # Report on-disk size of this run responses, comparable between storage formats
+            raw_metadata["stored_bytes"] = raw_stored_bytes(engine, "etapa_swmfbq_raw", timestamp_string, upsert_columns)
+            context.add_output_metadata(raw_metadata)
 
         # Return DataFrame
         return df_raw
@@ -129,8 +177,8 @@ def mfqb_data_bronze (context: dg.AssetExecutionContext,
         for index, row in mfqb_data_raw.iterrows():
             
             try:
-                # Load response text as JSON
-                r_resp = json.loads(row['response'])
+                # Load response text as JSON, decompress if needed
+                r_resp = json.loads(decode_response(row))
                 
                 # Transform dict to DataFrame rows
                 rows = []
@@ -169,31 +217,36 @@ def mfqb_data_bronze (context: dg.AssetExecutionContext,
             # Get SQLAlchemy engine
             engine = postgres_rsc.get_engine()
             
-            # Reflect etapa_swmfbq_data table
-            metadata = MetaData()
-            etapa_swmfbq_data = Table(
-                "etapa_swmfbq_data",
-                metadata,
-                schema="public",
-                autoload_with=engine
-            )
-
-            # Convert DataFrame to list of dicts
-            records = df_transf.to_dict(orient="records")
+            # Create missing year partitions before writing
+            add_year_partitions(engine, "etapa_swmfbq_data", "fecha", df_transf['fecha'].dt.year.unique())
             
-            # Build an UPSERT statement
-            stmt = insert(etapa_swmfbq_data).values(records)
-            stmt = stmt.on_conflict_do_update(
-                index_elements=["codigo", "parametro", "fecha"],
-                set_= {
-                    "abreviacion": stmt.excluded.abreviacion,
-                    "valor": stmt.excluded.valor,
-                }
-            )
-
-            # Execute statement
+            # UPSERT per year straight into its partition, skipping parent tuple routing
+            metadata = MetaData()
             with engine.begin() as conn:
-                conn.execute(stmt)
+                for year, df_year in df_transf.groupby(df_transf['fecha'].dt.year):
+                    # Reflect etapa_swmfbq_data year partition, or table if not partitioned
+                    etapa_swmfbq_data = Table(
+                        year_partition(conn, "etapa_swmfbq_data", year),
+                        metadata,
+                        schema="public",
+                        autoload_with=conn
+                    )
+                    
+                    # Convert DataFrame to list of dicts
+                    records = df_year.to_dict(orient="records")
+                    
+                    # Build an UPSERT statement
+                    stmt = insert(etapa_swmfbq_data).values(records)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=["codigo", "parametro", "fecha"],
+                        set_= {
+                            "abreviacion": stmt.excluded.abreviacion,
+                            "valor": stmt.excluded.valor,
+                        }
+                    )
+                    
+                    # Execute statement
+                    conn.execute(stmt)
         
         # Return DataFrame
         return df_transf
@@ -210,15 +263,18 @@ def mfqb_data_bronze (context: dg.AssetExecutionContext,
 )
 def mfqb_data_silver (context: dg.AssetExecutionContext,
                 mfqb_data_bronze: pd.DataFrame,
-                postgres_rsc: PostgresResource,) -> None:
+                postgres_rsc: PostgresResource,) -> pd.DataFrame:
     """
     Use BMWP parametro data to create a DataFrame that matches IERSE registro_bmwp database table.
     Add required columns and drop not used ones.
     Perform an UPSERT operations over registro_bmwp table.
+    Returns inserted or changed rows (cod_estacion, fecha_reg) for rollup refresh.
     """
     
     
     engine = None
+    # Inserted or changed rows DataFrame
+    df_changed = pd.DataFrame(columns=['cod_estacion', 'fecha_reg'])
     try:
         # Pick BMWP data only
         df_bmwp = mfqb_data_bronze[mfqb_data_bronze['parametro'] == 'BMWP']
@@ -244,40 +300,95 @@ def mfqb_data_silver (context: dg.AssetExecutionContext,
             # Get SQLAlchemy engine
             engine = postgres_rsc.get_engine()
             
-            # Reflect etapa_swmfbq_data table
-            metadata = MetaData()
-            registro_bwmp = Table(
-                "registro_bmwp",
-                metadata,
-                schema="public",
-                autoload_with=engine
-            )
-
-            # Convert DataFrame to list of dicts
-            records = df_bmwp.to_dict(orient="records")
+            # Create missing year partitions before writing
+            add_year_partitions(engine, "registro_bmwp", "fecha_reg", df_bmwp['fecha_reg'].dt.year.unique())
             
-            # Build an UPSERT statement
-            stmt = insert(registro_bwmp).values(records)
-            stmt = stmt.on_conflict_do_update(
-                index_elements=["cod_estacion", "fecha_reg"],
-                set_= {
-                    "habilitado": stmt.excluded.habilitado,
-                    "origen": stmt.excluded.origen,
-                    "valorbmwp": stmt.excluded.valorbmwp,
-                }
-            )
-
-            # Execute statement
+            # UPSERT per year straight into its partition, skipping parent tuple routing
+            changed_rows = []
+            metadata = MetaData()
             with engine.begin() as conn:
-                conn.execute(stmt)
+                for year, df_year in df_bmwp.groupby(df_bmwp['fecha_reg'].dt.year):
+                    # Reflect registro_bmwp year partition, or table if not partitioned
+                    registro_bwmp = Table(
+                        year_partition(conn, "registro_bmwp", year),
+                        metadata,
+                        schema="public",
+                        autoload_with=conn
+                    )
+                    
+                    # Convert DataFrame to list of dicts
+                    records = df_year.to_dict(orient="records")
+                    
+                    # Build an UPSERT statement
+                    stmt = insert(registro_bwmp).values(records)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=["cod_estacion", "fecha_reg"],
+                        set_= {
+                            "habilitado": stmt.excluded.habilitado,
+                            "origen": stmt.excluded.origen,
+                            "valorbmwp": stmt.excluded.valorbmwp,
+                        },
+                        # Skip unchanged rows
+                        where=or_(
+                            registro_bwmp.c.valorbmwp.is_distinct_from(stmt.excluded.valorbmwp),
+                            registro_bwmp.c.habilitado.is_distinct_from(stmt.excluded.habilitado),
+                            registro_bwmp.c.origen.is_distinct_from(stmt.excluded.origen),
+                        )
+                    )
+                    stmt = stmt.returning(registro_bwmp.c.cod_estacion, registro_bwmp.c.fecha_reg)
+                    
+                    # Execute statement, keep inserted or changed rows
+                    changed_rows.extend(conn.execute(stmt).fetchall())
+            df_changed = pd.DataFrame(changed_rows, columns=['cod_estacion', 'fecha_reg'])
+            df_changed['fecha_reg'] = pd.to_datetime(df_changed['fecha_reg'])
+            context.log.info(f"{len(df_changed)} registro_bmwp rows inserted or changed")
         
-        # Finish asset execution
-        pass
+        # Return DataFrame
+        return df_changed
         
     except Exception as exc:
         context.log.error(f"Error upLoading BMWP data from ETAPA to IERSE.\n{str(exc)}")
-        pass
+        return pd.DataFrame(columns=['cod_estacion', 'fecha_reg'])
     finally:
         # Dipose engine
         if engine:
-            engine.dispose()
\ No newline at end of file
+            engine.dispose()
+
+@dg.asset(
+    group_name="etapa_to_ierse_bmwp",
+)
+def mfqb_data_gold (context: dg.AssetExecutionContext,
+                mfqb_data_silver: pd.DataFrame,
+                postgres_rsc: PostgresResource,
+                config: RollupConfig,) -> None:
+    """
+    Refresh rollup_bmwp table with yearly aggregates per station from registro_bmwp:
+    latest value, min/max/mean and trend. BMWP is yearly data, monthly rollups are skipped.
+    Stations and periods changed on current run silver upload are refreshed, along with
+    stations whose rollups are missing or out of sync with registro_bmwp.
+    Set full_rebuild config to rebuild every station.
+    """
+    
+    engine = None
+    try:
+        # Get SQLAlchemy engine
+        engine = postgres_rsc.get_engine()
+        
+        # Recompute changed and out of sync stations-periods rollups
+        n_rows = refresh_station_rollups(engine, mfqb_data_silver,
+                                        source_table="registro_bmwp",
+                                        value_column="valorbmwp",
+                                        rollup_table="rollup_bmwp",
+                                        periods=["year"],
+                                        full_rebuild=config.full_rebuild)
+        context.log.info(f"Refreshed {n_rows} rollup_bmwp rows")
+        context.add_output_metadata({"rollup_rows": n_rows})
+        
+    except Exception as exc:
+        # Fail the run, rerun with full_rebuild config if changed values were not refreshed
+        context.log.error(f"Error refreshing BMWP rollups on IERSE.\n{str(exc)}")
+        raise
+    finally:
+        # Dipose engine
+        if engine:
+            engine.dispose()
@@ -0,0 +1,408 @@
+from .tools import (
+    compress_response,
+    decode_response,
+    earliest_period_starts,
+)
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+import pandas as pd
+
+def has_raw_compression_column(engine: Engine, table_name: str) -> bool:
+    """
+    Check if an etapa_*_raw table has the response_zlib bytea column.
+    """
+    with engine.begin() as conn:
+        exists = conn.execute(text("""SELECT 1 FROM information_schema.columns
+                                WHERE table_schema = 'public'
+                                    AND table_name = :table_name
+                                    AND column_name = 'response_zlib';"""),
+                            {"table_name": table_name}).scalar()
+    return exists is not None
+
+def add_raw_compression_column(engine: Engine, table_name: str) -> None:
+    """
+    Add response_zlib bytea column to an etapa_*_raw table, so compressed
+    responses can be stored while response column is left empty.
+    Only alters the table when the column is missing.
+    """
+    if has_raw_compression_column(engine, table_name):
+        return
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE public.{table_name} ADD COLUMN response_zlib bytea;"))
+        conn.execute(text(f"ALTER TABLE public.{table_name} ALTER COLUMN response DROP NOT NULL;"))
+
+def convert_raw_storage(engine: Engine, table_name: str, compress: bool, batch_size: int = 50) -> int:
+    """
+    Rewrite rows of an etapa_*_raw table stored on the other format, in batches:
+    text responses are compressed to response_zlib when compress is True,
+    compressed responses are decoded back to text otherwise.
+    Space is reused by new rows after VACUUM, run VACUUM FULL to shrink the table files.
+    Returns the number of rewritten rows.
+    """
+    source, target = ("response", "response_zlib") if compress else ("response_zlib", "response")
+    n_rows = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(f"""SELECT "timestamp", codigo, response, response_zlib
+                                FROM public.{table_name}
+                                WHERE {source} IS NOT NULL
+                                LIMIT :batch_size;"""), {"batch_size": batch_size}).mappings().all()
+            if not rows:
+                return n_rows
+            conn.execute(text(f"""UPDATE public.{table_name}
+                            SET {target} = :value, {source} = NULL
+                            WHERE "timestamp" = :timestamp AND codigo = :codigo;"""),
+                        [{"timestamp": r["timestamp"],
+                            "codigo": r["codigo"],
+                            "value": compress_response(r["response"]) if compress else decode_response(r)} for r in rows])
+            n_rows += len(rows)
+
+def read_raw_responses(engine: Engine, table_name: str, timestamp: str) -> pd.DataFrame:
+    """
+    Read stored raw responses of an etapa_*_raw table for a request timestamp,
+    stored either as text or compressed.
+    Returns a DataFrame with timestamp, codigo and decoded response columns.
+    """
+    sql_query = f"""SELECT *
+                FROM public.{table_name}
+                WHERE "timestamp" = %(timestamp)s;"""
+    df = pd.read_sql(sql_query, con=engine, params={"timestamp": timestamp})
+    if len(df) > 0:
+        df['response'] = df.apply(decode_response, axis=1)
+    return df.reindex(columns=['timestamp', 'codigo', 'response'])
+
+def raw_stored_bytes(engine: Engine, table_name: str, timestamp: str, columns: list) -> int:
+    """
+    On-disk size (after TOAST compression) of the response columns stored for a request timestamp.
+    """
+    column_sizes = " + ".join(f"coalesce(pg_column_size({col}), 0)" for col in columns)
+    with engine.begin() as conn:
+        return int(conn.execute(text(f"""SELECT coalesce(sum({column_sizes}), 0)
+                                FROM public.{table_name}
+                                WHERE "timestamp" = :timestamp;"""),
+                            {"timestamp": timestamp}).scalar())
+
+# Rollup periods: pandas period frequency and Postgres interval
+ROLLUP_PERIODS = {
+    "year": ("Y", "1 year"),
+    "month": ("M", "1 month"),
+}
+
+def create_rollup_table(engine: Engine, rollup_table: str) -> None:
+    """
+    Create a station rollup table if it does not exist.
+    """
+    sql_ddl = f"""CREATE TABLE IF NOT EXISTS public.{rollup_table} (
+                    cod_estacion text NOT NULL,
+                    periodo text NOT NULL,
+                    fecha_periodo timestamp NOT NULL,
+                    n_registros integer NOT NULL,
+                    fecha_ultimo timestamp,
+                    valor_ultimo double precision,
+                    valor_min double precision,
+                    valor_max double precision,
+                    valor_medio double precision,
+                    tendencia double precision,
+                    PRIMARY KEY (cod_estacion, periodo, fecha_periodo)
+                );"""
+    with engine.begin() as conn:
+        conn.execute(text(sql_ddl))
+
+def refresh_station_rollups(engine: Engine, df: pd.DataFrame, source_table: str,
+                            value_column: str, rollup_table: str,
+                            periods: list = list(ROLLUP_PERIODS),
+                            full_rebuild: bool = False) -> int:
+    """
+    Recompute rollups of source_table (registro_*) for the stations present on df
+    (cod_estacion, fecha_reg columns), from their earliest changed period onwards.
+    Stations whose rollups are missing or out of sync with source_table (record count
+    or latest date), and all stations on full_rebuild, are rebuilt from start of history.
+    Stores latest value and min/max/mean per period, and trend as the least-squares
+    slope per year of the station values from start of history to the end of the period,
+    so later periods are refreshed too when an earlier value changes.
+    Returns the number of rollup rows written.
+    """
+    create_rollup_table(engine, rollup_table)
+    
+    # Enabled and numeric source rows filter, by table alias
+    def valid_rows(alias):
+        return f"""{alias}.habilitado
+                    AND {alias}.{value_column} IS NOT NULL
+                    AND {alias}.{value_column} <> 'NaN'"""
+    
+    n_rows = 0
+    with engine.begin() as conn:
+        for periodo in periods:
+            freq, interval = ROLLUP_PERIODS[periodo]
+            
+            # Earliest changed period per station, plus stations out of sync with source table
+            codigos, fechas = earliest_period_starts(df, freq)
+            keys = conn.execute(text(f"""WITH src AS (
+                                SELECT r.cod_estacion::text AS cod_estacion, count(*) AS n, max(r.fecha_reg) AS ultimo
+                                FROM public.{source_table} r
+                                WHERE {valid_rows('r')}
+                                GROUP BY 1
+                            ), ru AS (
+                                SELECT cod_estacion, sum(n_registros) AS n, max(fecha_ultimo) AS ultimo
+                                FROM public.{rollup_table}
+                                WHERE periodo = :periodo
+                                GROUP BY 1
+                            )
+                            SELECT cod_estacion, min(fecha_desde)::text
+                            FROM (
+                                SELECT * FROM unnest(CAST(:codigos AS text[]), CAST(:fechas AS timestamp[]))
+                                UNION ALL
+                                SELECT coalesce(src.cod_estacion, ru.cod_estacion), '1900-01-01'::timestamp
+                                FROM src
+                                FULL JOIN ru ON ru.cod_estacion = src.cod_estacion
+                                WHERE :full_rebuild
+                                    OR src.n IS DISTINCT FROM ru.n
+                                    OR src.ultimo IS DISTINCT FROM ru.ultimo
+                            ) AS k(cod_estacion, fecha_desde)
+                            GROUP BY cod_estacion;"""),
+                        {"periodo": periodo, "codigos": codigos, "fechas": fechas,
+                            "full_rebuild": full_rebuild}).all()
+            if not keys:
+                continue
+            params = {
+                "periodo": periodo,
+                "codigos": [k[0] for k in keys],
+                "fechas": [k[1] for k in keys],
+            }
+            
+            # Remove rollups from earliest changed period, periods may have no enabled records left
+            conn.execute(text(f"""DELETE FROM public.{rollup_table} ru
+                            USING unnest(CAST(:codigos AS text[]), CAST(:fechas AS timestamp[])) AS t(cod_estacion, fecha_desde)
+                            WHERE ru.periodo = :periodo
+                                AND ru.cod_estacion = t.cod_estacion
+                                AND ru.fecha_periodo >= t.fecha_desde;"""), params)
+            
+            # Aggregate stations periods from earliest changed one, trend over history up to period end
+            result = conn.execute(text(f"""INSERT INTO public.{rollup_table}
+                            SELECT p.cod_estacion,
+                                :periodo,
+                                p.fecha_periodo,
+                                count(*),
+                                max(p.fecha_reg),
+                                (array_agg(p.valor ORDER BY p.fecha_reg DESC))[1],
+                                min(p.valor),
+                                max(p.valor),
+                                avg(p.valor),
+                                (SELECT regr_slope(h.{value_column}, extract(epoch FROM h.fecha_reg) / 31557600.0)
+                                    FROM public.{source_table} h
+                                    WHERE h.cod_estacion = p.cod_estacion
+                                        AND h.fecha_reg < p.fecha_periodo + interval '{interval}'
+                                        AND {valid_rows('h')})
+                            FROM (
+                                SELECT t.cod_estacion,
+                                    date_trunc('{periodo}', r.fecha_reg) AS fecha_periodo,
+                                    r.fecha_reg,
+                                    r.{value_column} AS valor
+                                FROM unnest(CAST(:codigos AS text[]), CAST(:fechas AS timestamp[])) AS t(cod_estacion, fecha_desde)
+                                JOIN public.{source_table} r
+                                    ON r.cod_estacion = t.cod_estacion
+                                    AND r.fecha_reg >= t.fecha_desde
+                                WHERE {valid_rows('r')}
+                            ) p
+                            GROUP BY p.cod_estacion, p.fecha_periodo;"""), params)
+            n_rows += result.rowcount
+    return n_rows
+
+# Year range partitioned tables: partition key and upsert unique columns
+PARTITIONED_TABLES = {
+    "etapa_swmfbq_data": ("fecha", ["codigo", "parametro", "fecha"]),
+    "etapa_swmfqagl_data": ("fecha", ["codigo", "parametro", "fecha"]),
+    "registro_bmwp": ("fecha_reg", ["cod_estacion", "fecha_reg"]),
+    "registro_wqi": ("fecha_reg", ["cod_estacion", "fecha_reg"]),
+}
+
+def is_partitioned(conn, table_name: str) -> bool:
+    """
+    Check if a public table is a declaratively partitioned table.
+    """
+    relkind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table_name);"),
+                        {"table_name": f"public.{table_name}"}).scalar()
+    return relkind == "p"
+
+def create_year_partition(conn, table_name: str, key_column: str, year: int) -> None:
+    """
+    Create and attach the {table_name}_y{year} partition. Rows of that year stored
+    on the default partition are moved to the new partition before attaching it.
+    Matching unique indexes are created by Postgres on attach.
+    """
+    partition = f"{table_name}_y{year}"
+    date_from = f"{year}-01-01"
+    date_to = f"{year + 1}-01-01"
+    conn.execute(text(f"""CREATE TABLE public.{partition}
+                    (LIKE public.{table_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);"""))
+    conn.execute(text(f"""WITH moved AS (
+                        DELETE FROM public.{table_name}_default
+                        WHERE {key_column} >= '{date_from}' AND {key_column} < '{date_to}'
+                        RETURNING *
+                    )
+                    INSERT INTO public.{partition} SELECT * FROM moved;"""))
+    conn.execute(text(f"""ALTER TABLE public.{table_name} ATTACH PARTITION public.{partition}
+                    FOR VALUES FROM ('{date_from}') TO ('{date_to}');"""))
+
+def partition_blockers(conn, table_name: str, key_column: str) -> list:
+    """
+    List objects that would stay attached to the original table on conversion,
+    or can not be kept on a partitioned table: dependent views, foreign keys
+    referencing the table, user triggers and unique indexes without key_column.
+    """
+    params = {"table_name": f"public.{table_name}", "key_column": key_column}
+    views = conn.execute(text("""SELECT DISTINCT 'view ' || rw.ev_class::regclass::text
+                        FROM pg_depend d
+                        JOIN pg_rewrite rw ON rw.oid = d.objid
+                        WHERE d.classid = 'pg_rewrite'::regclass
+                            AND d.refclassid = 'pg_class'::regclass
+                            AND d.refobjid = to_regclass(:table_name)
+                            AND rw.ev_class <> d.refobjid;"""), params).scalars().all()
+    foreign_keys = conn.execute(text("""SELECT 'foreign key ' || conname || ' on ' || conrelid::regclass::text
+                        FROM pg_constraint
+                        WHERE contype = 'f'
+                            AND confrelid = to_regclass(:table_name);"""), params).scalars().all()
+    triggers = conn.execute(text("""SELECT 'trigger ' || tgname
+                        FROM pg_trigger
+                        WHERE tgrelid = to_regclass(:table_name)
+                            AND NOT tgisinternal;"""), params).scalars().all()
+    unique_indexes = conn.execute(text("""SELECT 'unique index ' || i.indexrelid::regclass::text || ' without ' || :key_column
+                        FROM pg_index i
+                        WHERE i.indrelid = to_regclass(:table_name)
+                            AND i.indisunique
+                            AND NOT EXISTS (
+                                SELECT 1 FROM pg_attribute a
+                                WHERE a.attrelid = i.indrelid
+                                    AND a.attnum = ANY(i.indkey)
+                                    AND a.attname = :key_column
+                            );"""), params).scalars().all()
+    return views + foreign_keys + triggers + unique_indexes
+
+def partition_table_by_year(engine: Engine, table_name: str, key_column: str,
+                            unique_columns: list) -> bool:
+    """
+    Convert a heap table to a range partitioned table by key_column year, with a
+    unique index on unique_columns (upsert conflict target) and a default partition.
+    Columns, defaults, identities, indexes, outgoing foreign keys, owner and privileges
+    are copied, and serial sequences are moved to the new table.
+    Aborts if views, incoming foreign keys or triggers depend on the table.
+    Original table is kept as {table_name}_unpartitioned, it can be dropped without CASCADE once verified.
+    Returns True if the table was converted, False if it was already partitioned.
+    """
+    with engine.begin() as conn:
+        if is_partitioned(conn, table_name):
+            return False
+        
+        # Objects that would keep pointing to the original table
+        blockers = partition_blockers(conn, table_name, key_column)
+        if blockers:
+            raise RuntimeError(f"Can not partition {table_name}, migrate or drop first: {', '.join(blockers)}")
+        
+        # Swap original table with a partitioned one
+        old_table = f"{table_name}_unpartitioned"
+        conn.execute(text(f"ALTER TABLE public.{table_name} RENAME TO {old_table};"))
+        conn.execute(text(f"""CREATE TABLE public.{table_name}
+                        (LIKE public.{old_table} INCLUDING ALL)
+                        PARTITION BY RANGE ({key_column});"""))
+        
+        # Upsert conflict target, unless copied from original table
+        upsert_index = conn.execute(text("""SELECT 1 FROM pg_index i
+                        WHERE i.indrelid = to_regclass(:table_name)
+                            AND i.indisunique
+                            AND (SELECT array_agg(a.attname::text ORDER BY a.attname::text)
+                                FROM pg_attribute a
+                                WHERE a.attrelid = i.indrelid
+                                    AND a.attnum = ANY(i.indkey)) = CAST(:columns AS text[]);"""),
+                        {"table_name": f"public.{table_name}", "columns": sorted(unique_columns)}).scalar()
+        if upsert_index is None:
+            conn.execute(text(f"""CREATE UNIQUE INDEX {table_name}_upsert_uidx
+                            ON public.{table_name} ({", ".join(unique_columns)});"""))
+        
+        # Outgoing foreign keys
+        foreign_keys = conn.execute(text("""SELECT quote_ident(conname), pg_get_constraintdef(oid)
+                        FROM pg_constraint
+                        WHERE contype = 'f'
+                            AND conrelid = to_regclass(:old_table);"""),
+                        {"old_table": f"public.{old_table}"}).all()
+        for conname, condef in foreign_keys:
+            conn.execute(text(f"ALTER TABLE public.{table_name} ADD CONSTRAINT {conname} {condef};"))
+        
+        # Owner and privileges
+        owner = conn.execute(text("""SELECT quote_ident(pg_get_userbyid(relowner))
+                        FROM pg_class
+                        WHERE oid = to_regclass(:old_table);"""),
+                        {"old_table": f"public.{old_table}"}).scalar()
+        conn.execute(text(f"ALTER TABLE public.{table_name} OWNER TO {owner};"))
+        grants = conn.execute(text("""SELECT CASE WHEN a.grantee = 0 THEN 'PUBLIC'
+                                    ELSE quote_ident(pg_get_userbyid(a.grantee)) END,
+                                a.privilege_type
+                        FROM pg_class c, aclexplode(c.relacl) a
+                        WHERE c.oid = to_regclass(:old_table);"""),
+                        {"old_table": f"public.{old_table}"}).all()
+        for grantee, privilege in grants:
+            conn.execute(text(f"GRANT {privilege} ON public.{table_name} TO {grantee};"))
+        
+        conn.execute(text(f"CREATE TABLE public.{table_name}_default PARTITION OF public.{table_name} DEFAULT;"))
+        
+        # One partition per existing year, then copy rows
+        years = conn.execute(text(f"""SELECT DISTINCT extract(year FROM {key_column})::int
+                        FROM public.{old_table}
+                        WHERE {key_column} IS NOT NULL;""")).scalars().all()
+        for year in sorted(years):
+            create_year_partition(conn, table_name, key_column, year)
+        conn.execute(text(f"""INSERT INTO public.{table_name} OVERRIDING SYSTEM VALUE
+                        SELECT * FROM public.{old_table};"""))
+        
+        # Move serial sequences ownership to the new table
+        sequences = conn.execute(text("""SELECT d.objid::regclass::text, quote_ident(a.attname)
+                        FROM pg_depend d
+                        JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+                        JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+                        WHERE d.classid = 'pg_class'::regclass
+                            AND d.refobjid = to_regclass(:old_table)
+                            AND d.deptype = 'a';"""),
+                        {"old_table": f"public.{old_table}"}).all()
+        for sequence, column in sequences:
+            conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY public.{table_name}.{column};"))
+        
+        # Continue identity sequences after copied values
+        identities = conn.execute(text("""SELECT attname
+                        FROM pg_attribute
+                        WHERE attrelid = to_regclass(:table_name)
+                            AND attidentity <> ''
+                            AND NOT attisdropped;"""),
+                        {"table_name": f"public.{table_name}"}).scalars().all()
+        for column in identities:
+            conn.execute(text(f"""SELECT setval(pg_get_serial_sequence(:table_name, :column), max("{column}"))
+                            FROM public.{table_name};"""),
+                        {"table_name": f"public.{table_name}", "column": column})
+    return True
+
+def year_partition(conn, table_name: str, year: int) -> str:
+    """
+    Name of the {table_name}_y{year} partition if it exists, else table_name.
+    Upserting straight into the partition uses its unique index, created on attach.
+    """
+    partition = f"{table_name}_y{int(year)}"
+    exists = conn.execute(text("SELECT to_regclass(:partition);"),
+                        {"partition": f"public.{partition}"}).scalar()
+    return table_name if exists is None else partition
+
+def add_year_partitions(engine: Engine, table_name: str, key_column: str, years) -> list:
+    """
+    Create missing year partitions of a partitioned table before writing into them.
+    Does nothing if the table is not partitioned yet.
+    Returns the list of created partition years.
+    """
+    created = []
+    with engine.begin() as conn:
+        if not is_partitioned(conn, table_name):
+            return created
+        for year in sorted({int(y) for y in years}):
+            exists = conn.execute(text("SELECT to_regclass(:partition);"),
+                                {"partition": f"public.{table_name}_y{year}"}).scalar()
+            if exists is None:
+                create_year_partition(conn, table_name, key_column, year)
+                created.append(year)
+    return created
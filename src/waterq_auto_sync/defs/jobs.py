@@ -1,26 +1,48 @@
 import dagster as dg
 from .assets import (
     pg_waterq_stations,
+    pg_raw_storage_migration,
+    pg_partition_migration,
+    pg_year_partitions,
 )
 from .bmwp_assets import(
     mfqb_data_raw,
     mfqb_data_bronze,
     mfqb_data_silver,
+    mfqb_data_gold,
 )
 from .wqi_assets import(
     mfqagl_data_raw,
     mfqagl_data_bronze,
     mfqagl_data_silver,
+    mfqagl_data_gold,
 )
 
 etapa_to_ierse_bmwp_job = dg.define_asset_job(
     name="etapa_to_ierse_bmwp_job",
-    selection=[pg_waterq_stations, mfqb_data_raw, mfqb_data_bronze, mfqb_data_silver,],
+    selection=[pg_waterq_stations, mfqb_data_raw, mfqb_data_bronze, mfqb_data_silver, mfqb_data_gold,],
 )
 
 etapa_to_ierse_wqi_job = dg.define_asset_job(
     name="etapa_to_ierse_wqi_job",
-    selection=[pg_waterq_stations, mfqagl_data_raw, mfqagl_data_bronze, mfqagl_data_silver,],
+    selection=[pg_waterq_stations, mfqagl_data_raw, mfqagl_data_bronze, mfqagl_data_silver, mfqagl_data_gold,],
+)
+
+# Manually launched, not scheduled
+ierse_raw_storage_job = dg.define_asset_job(
+    name="ierse_raw_storage_job",
+    selection=[pg_raw_storage_migration,],
+)
+
+# Manually launched, not scheduled
+ierse_partition_migration_job = dg.define_asset_job(
+    name="ierse_partition_migration_job",
+    selection=[pg_partition_migration,],
+)
+
+ierse_partition_maintenance_job = dg.define_asset_job(
+    name="ierse_partition_maintenance_job",
+    selection=[pg_year_partitions,],
 )
 
 
@@ -30,5 +52,7 @@ def resources() -> dg.Definitions:
         jobs=[
             etapa_to_ierse_bmwp_job,
             etapa_to_ierse_wqi_job,
+            ierse_partition_migration_job,
+            ierse_partition_maintenance_job,
         ]
     )
\ No newline at end of file
@@ -15,6 +15,8 @@ class PostgresResource(dg.ConfigurableResource):
     database: str
     username: str
     password: str
+    # Store raw endpoint responses zlib-compressed (bytea) instead of text
+    raw_compression: bool = False
     
     def get_engine(self) -> Engine:
         connection_uri = f"postgresql://{self.username}:{self.password}@{self.hostname}:{self.port}/{self.database}"
@@ -29,7 +31,8 @@ def resources() -> dg.Definitions:
                 port=int(os.getenv("PG_PORT")),
                 database=os.getenv("PG_DATABASE"),
                 username=os.getenv("PG_USER"),
-                password=os.getenv("PG_PASSWORD")
+                password=os.getenv("PG_PASSWORD"),
+                raw_compression=os.getenv("PG_RAW_COMPRESSION", "false").lower() == "true",
             ),
         }
     )
\ No newline at end of file
@@ -2,6 +2,7 @@ import dagster as dg
 from .jobs import (
     etapa_to_ierse_bmwp_job,
     etapa_to_ierse_wqi_job,
+    ierse_partition_maintenance_job,
 )
 
 etapa_to_ierse_bmwp_schedule = dg.ScheduleDefinition(
@@ -15,6 +16,12 @@ etapa_to_ierse_wqi_schedule = dg.ScheduleDefinition(
     cron_schedule="0 2 1 * *",
     execution_timezone="America/Guayaquil",
 )
+# Mid December, next year partitions exist before January runs
+ierse_partition_maintenance_schedule = dg.ScheduleDefinition(
+    job=ierse_partition_maintenance_job,
+    cron_schedule="0 0 15 12 *",
+    execution_timezone="America/Guayaquil",
+)
 
 @dg.definitions
 def resources() -> dg.Definitions:
@@ -22,5 +29,6 @@ def resources() -> dg.Definitions:
         schedules=[
             etapa_to_ierse_bmwp_schedule,
             etapa_to_ierse_wqi_schedule,
+            ierse_partition_maintenance_schedule,
         ]
     )
\ No newline at end of file
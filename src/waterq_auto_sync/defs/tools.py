@@ -1,4 +1,5 @@
 import math
+import zlib
 
 def coerse_float(input):
     try:
@@ -6,3 +7,31 @@ def coerse_float(input):
         return float_value
     except ValueError:
         return math.nan
+
+def compress_response(text):
+    """
+    Compress an endpoint response text to zlib bytes for bytea storage.
+    """
+    return zlib.compress(text.encode("utf-8"), 9)
+
+def decode_response(row):
+    """
+    Return the response text of a raw row, stored either as plain text
+    on response column or compressed on response_zlib column.
+    """
+    response = row.get('response')
+    if isinstance(response, str):
+        return response
+    return zlib.decompress(bytes(row['response_zlib'])).decode("utf-8")
+
+def earliest_period_starts(df, freq):
+    """
+    Earliest period start per station of a DataFrame with cod_estacion and fecha_reg columns,
+    for a pandas period frequency ("Y" or "M").
+    Returns station codes list and "%Y-%m-%d" period start dates list.
+    """
+    if len(df) == 0:
+        return [], []
+    fecha_desde = df.groupby(df['cod_estacion'].astype(str))['fecha_reg'].min()
+    fecha_desde = fecha_desde.dt.to_period(freq).dt.start_time.dt.strftime("%Y-%m-%d")
+    return fecha_desde.index.tolist(), fecha_desde.tolist()
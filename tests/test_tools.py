@@ -0,0 +1,48 @@
+import zlib
+
+from waterq_auto_sync.defs.tools import (
+    compress_response,
+    decode_response,
+    earliest_period_starts,
+)
+
+RESPONSE = '{"parametros": [{"nombre": "WQI", "abreviacion": "WQI", "mediciones": []}]}'
+
+def test_compress_response_is_zlib():
+    assert zlib.decompress(compress_response(RESPONSE)).decode("utf-8") == RESPONSE
+
+def test_decode_response_text_row():
+    assert decode_response({"response": RESPONSE}) == RESPONSE
+
+def test_decode_response_text_row_ignores_stale_zlib():
+    assert decode_response({"response": RESPONSE, "response_zlib": compress_response("{}")}) == RESPONSE
+
+def test_decode_response_bytea_row():
+    row = {"response": None, "response_zlib": compress_response(RESPONSE)}
+    assert decode_response(row) == RESPONSE
+
+def test_decode_response_memoryview_row():
+    # psycopg2 returns bytea columns as memoryview
+    row = {"response": None, "response_zlib": memoryview(compress_response(RESPONSE))}
+    assert decode_response(row) == RESPONSE
+
+def test_decode_response_non_ascii_round_trip():
+    text = '{"estacion": "Río Tomebamba - Monay"}'
+    assert decode_response({"response": None, "response_zlib": compress_response(text)}) == text
+
+def silver_rows():
+    import pandas as pd
+    return pd.DataFrame({
+        'cod_estacion': ['M01', 'M01', 'M02'],
+        'fecha_reg': pd.to_datetime(['2021-12-31', '2020-05-17', '2022-03-04']),
+    })
+
+def test_earliest_period_starts_year():
+    assert earliest_period_starts(silver_rows(), "Y") == (['M01', 'M02'], ['2020-01-01', '2022-01-01'])
+
+def test_earliest_period_starts_month():
+    assert earliest_period_starts(silver_rows(), "M") == (['M01', 'M02'], ['2020-05-01', '2022-03-01'])
+
+def test_earliest_period_starts_empty():
+    import pandas as pd
+    assert earliest_period_starts(pd.DataFrame(columns=['cod_estacion', 'fecha_reg']), "Y") == ([], [])